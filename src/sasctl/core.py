@@ -12,6 +12,7 @@ import netrc
 import os
 import re
 import ssl
+import threading
 import warnings
 from datetime import datetime, timedelta
 from urllib.error import HTTPError
@@ -306,6 +307,9 @@ class Session(requests.Session):
         self._id = uuid4().hex
         self.message_log = logger.getChild("session.%s" % self._id)
 
+        # Serializes access token refreshes when the session is shared by threads
+        self._auth_lock = threading.RLock()
+
         # If certificate path has already been set for SWAT package, make
         # Requests module reuse it.
         for k in ["SSLCALISTLOC", "CAS_CLIENT_SSL_CA_LIST"]:
@@ -635,6 +639,7 @@ class Session(requests.Session):
     ):
         url = self._build_url(url)
         verify = verify or self.verify
+        request_auth = self.auth
 
         try:
             r = super(Session, self).request(
@@ -662,9 +667,13 @@ class Session(requests.Session):
                 # Access token expired, need to refresh it (if we can)
                 if "access token expired" in auth_header:
                     try:
-                        self.auth = self._request_token_with_oauth(
-                            refresh_token=self.auth.refresh_token
-                        )
+                        with self._auth_lock:
+                            # Only refresh if another thread has not already
+                            # replaced the expired token.
+                            if self.auth is request_auth:
+                                self.auth = self._request_token_with_oauth(
+                                    refresh_token=self.auth.refresh_token
+                                )
 
                         # Repeat the request
                         r = super(Session, self).request(
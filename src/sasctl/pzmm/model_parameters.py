@@ -1,15 +1,20 @@
 # Copyright (c) 2022, SAS Institute Inc., Cary, NC, USA.  All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
+import copy
+import functools
 import json
-from distutils.version import StrictVersion
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from uuid import UUID
 
 import pandas as pd
 from pandas import DataFrame
+from requests.adapters import DEFAULT_POOLSIZE
 
 from .._services.model_repository import ModelRepository as mr
-from ..core import RestObj, current_session, is_uuid
+from ..core import HTTPError, RestObj, current_session, is_uuid
 
 try:
     import xgboost
@@ -24,50 +29,207 @@ MODEL_PROPERTIES = [
     ("function", "function"),
 ]
 
+# Number of models updated concurrently by ModelParameters.update_kpis; matches the
+# connection pool size of the session's adapters so connections are not discarded
+_MAX_WORKERS = DEFAULT_POOLSIZE
+# Attempts made by _retry before a 429 or 5xx response is raised to the caller
+_MAX_RETRIES = 3
+# Initial delay, in seconds, between retries; doubled after each attempt
+_RETRY_BACKOFF = 0.5
+# Separators used when serializing json files uploaded to SAS Model Manager
+_COMPACT_SEPARATORS = (",", ":")
+# Seconds a retrieved hyperparameter file is reused before it is requested again
+_HYPERPARAM_CACHE_TTL = 60
+# Hyperparameter file contents, file name, and retrieval time keyed by model id
+_HYPERPARAM_CACHE: Dict[str, Tuple[dict, str, float]] = {}
+# Substring identifying hyperparameter files and the server filter used to find them
+_HYPERPARAM_NEEDLE = "hyperparameters"
+_HYPERPARAM_FILTER = {"filter": f'contains($primary,name,"{_HYPERPARAM_NEEDLE}")'}
+
+
+def _retry(func: Callable) -> Callable:
+    """
+    Wraps a function making SAS Model Manager requests so that it is retried with
+    exponential backoff when the server responds with a 429 or 5xx status code.
+
+    Parameters
+    ----------
+    func : Callable
+        The function to be retried.
+
+    Returns
+    -------
+    Callable
+        The wrapped function.
+    """
+
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        for attempt in range(_MAX_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except HTTPError as e:
+                retryable = e.code == 429 or 500 <= e.code <= 599
+                if not retryable or attempt == _MAX_RETRIES - 1:
+                    raise
+                time.sleep(_RETRY_BACKOFF * 2**attempt)
+
+    return _wrapper
+
+
+def _resolve_model_id(model_key: str) -> str:
+    """
+    Returns the id of a registered model on SAS Model Manager. Names are looked up on
+    every call, so a model that is deleted and registered again under the same name
+    resolves to its current id.
+
+    Parameters
+    ----------
+    model_key : str
+        The name or id of the model. Dictionary representations of a model should
+        be reduced to their "id" or "name" value by the caller.
+
+    Returns
+    -------
+    str
+        The id of the model.
+    """
+    if is_uuid(model_key):
+        return model_key
+    return mr.get_model(model_key)["id"]
+
+
+def _resolve_project_id(project_key: str) -> str:
+    """
+    Returns the id of a project on SAS Model Manager.
+
+    Parameters
+    ----------
+    project_key : str
+        The name or id of the project.
+
+    Returns
+    -------
+    str
+        The id of the project.
+    """
+    if is_uuid(project_key):
+        return project_key
+    return mr.get_project(project_key)["id"]
+
+
+def _coerce_to_id(
+    obj: Union[str, dict, RestObj, UUID],
+    resolve: Callable[[str], str] = _resolve_model_id,
+) -> str:
+    """
+    Returns the id of a SAS Model Manager object referenced by its name, its id, or a
+    dictionary representation.
+
+    Parameters
+    ----------
+    obj : str, dict, RestObj, or uuid.UUID
+        The name or id of the object, or a dictionary representation of the object.
+    resolve : Callable, optional
+        Function returning the id of an object from its name or id. The default value
+        resolves model ids.
+
+    Returns
+    -------
+    str
+        The id of the object.
 
-# TODO: Maybe just move _find_file altogether?
-def _find_file(model: Union[str, dict, RestObj], file_name: str) -> Tuple[RestObj, str]:
+    Raises
+    ------
+    TypeError
+        If obj is not a supported reference type.
+    """
+    if isinstance(obj, str):
+        return resolve(obj)
+    if isinstance(obj, dict):
+        return obj.get("id") or resolve(obj["name"])
+    if isinstance(obj, UUID):
+        return str(obj)
+    raise TypeError(f"Unsupported reference type: {type(obj)!r}")
+
+
+@_retry
+def _search_model_contents(
+    model_id: str, needle: str, params: dict
+) -> Tuple[RestObj, str]:
     """
     Retrieves the contents of the first file from a registered model on SAS Model
-    Manager that contains the provided file_name as an exact match or substring.
+    Manager with a name containing needle.
 
     Parameters
     ----------
-    model : str or dict
-        The name or id of the model, or a dictionary representation of the model.
-    file_name : str
-        The name of the desired file or a substring that is contained within the file
-        name.
+    model_id : str
+        The id of the model. Names should be resolved with _coerce_to_id by the
+        caller.
+    needle : str
+        Lowercase substring that is contained within the file name.
+    params : dict
+        Query parameters used to filter the model contents on the server.
 
     Returns
     -------
     RestObj, str
-        The contents and name of the first file with a name containing file_name.
+        The contents and name of the first file with a name containing needle.
     """
+    # Let the server filter the model contents, falling back to the full listing if
+    # the filter is rejected or returns no matches
+    try:
+        file_list = mr.get(f"models/{model_id}/contents", params=params)
+    except HTTPError as e:
+        if e.code != 400:
+            raise e
+        file_list = None
+    if isinstance(file_list, RestObj):
+        file_list = [file_list]
+    if not file_list:
+        file_list = mr.get_model_contents(model_id)
+
+    file = next((f for f in file_list if needle in f.name.lower()), None)
+    if file is None:
+        raise ValueError(f'No file containing "{needle}" exists within model files.')
+    correct_file = mr.get(f"models/{model_id}/contents/{file.id}/content")
+    return correct_file, file.name
+
+
+def _find_hyperparameter_file(model_id: str) -> Tuple[RestObj, str]:
+    """
+    Retrieves the contents of the hyperparameter file from a registered model on SAS
+    Model Manager.
 
-    file_list = mr.get_model_contents(model)
-    for file in file_list:
-        if file_name.lower() in file.name.lower():
-            correct_file = mr.get(f"models/{model}/contents/{file.id}/content")
-            return correct_file, file.name
-    raise ValueError(f'No file containing "{file_name}" exists within model files.')
+    The search substring and server filter are built once at import.
+
+    Parameters
+    ----------
+    model_id : str
+        The id of the model.
+
+    Returns
+    -------
+    RestObj, str
+        The contents and name of the hyperparameter file.
+    """
+    return _search_model_contents(model_id, _HYPERPARAM_NEEDLE, _HYPERPARAM_FILTER)
 
 
 class ModelParameters:
     @staticmethod
-    def _update_json(model: str, model_json: dict, kpis: DataFrame) -> dict:
+    def _update_json(model_json: dict, model_rows: DataFrame) -> dict:
         """
         Updates the contents of the hyperparameter json file
 
         Parameters
         ----------
-        model: str
-            The id of the model being updated.
         model_json: dict
             The contents of the current KPI/parameters file within SAS Model Manager.
-        kpis: pandas.DataFrame
-            The dataframe containing the KPI/parameter values stored within SAS Model
-            Manager at runtime.
+        model_rows: pandas.DataFrame
+            The rows of the KPI/parameter table stored within SAS Model Manager at
+            runtime that belong to the model being updated. The ModelUUID column is
+            not included in the updated file.
 
         Returns
         -------
@@ -75,18 +237,58 @@ class ModelParameters:
             The updated hyperparameter json file to be uploaded to SAS Model Manager.
         """
 
-        model_rows = kpis.loc[kpis["ModelUUID"] == model]
         if not model_rows.empty:
-            model_rows = model_rows.drop(columns=["ModelUUID"])
-            model_rows.set_index("TimeLabel", inplace=True)
-            kpi_json = model_rows.to_json(orient="index")
-            parsed_json = json.loads(kpi_json)
-            model_json["kpis"] = parsed_json
+            # Build the KPI dictionary directly instead of serializing the rows to json
+            # and parsing them back; keys and missing values match the json output
+            kpi_dict = model_rows.set_index("TimeLabel").to_dict(orient="index")
+            model_json["kpis"] = {
+                str(label): {
+                    key: None if pd.isna(value) else value
+                    for key, value in row.items()
+                    if key != "ModelUUID"
+                }
+                for label, row in kpi_dict.items()
+            }
         return model_json
 
+    @classmethod
+    def _process_model(cls, model: str, kpis: DataFrame) -> bool:
+        """
+        Adds the KPIs of a single model to its hyperparameter file and uploads the
+        updated file to SAS Model Manager.
+
+        Parameters
+        ----------
+        model : str
+            The id of the model being updated.
+        kpis : pandas.DataFrame
+            The rows of the KPI table belonging to the model.
+
+        Returns
+        -------
+        bool
+            True if the hyperparameter file was updated, or False if the model does
+            not contain a hyperparameter file.
+        """
+        # Only a missing hyperparameter file is expected; errors raised while
+        # updating or uploading the file are left to the caller
+        try:
+            current_params, file_name = _find_hyperparameter_file(model)
+        except ValueError:
+            return False
+        updated_json = cls._update_json(current_params, kpis)
+        _retry(mr.add_model_content)(
+            model, json.dumps(updated_json, separators=_COMPACT_SEPARATORS), file_name
+        )
+        _HYPERPARAM_CACHE.pop(model, None)
+        return True
+
     @staticmethod
     def generate_hyperparameters(
-        model: Any, model_prefix: str, pickle_path: Union[str, Path]
+        model: Any,
+        model_prefix: str,
+        pickle_path: Union[str, Path],
+        deep: Optional[bool] = False,
     ) -> None:
         """
         Generates hyperparameters for a given model and creates a JSON file
@@ -105,18 +307,23 @@ class ModelParameters:
             "Hyperparameters.json")
         pickle_path : str, pathlib.Path
             Directory location of model files.
+        deep : bool, optional
+            Sets whether the hyperparameters of nested scikit-learn estimators, such as
+            the steps of a Pipeline, are included. Estimator objects that cannot be
+            serialized are written as their string representation. The default value
+            is False.
         """
 
         def sklearn_params():
             """
             Generates hyperparameters for the models generated by scikit-learn.
             """
-            hyperparameters = model.get_params()
+            hyperparameters = model.get_params(deep=deep)
             model_json = {"hyperparameters": hyperparameters}
             with open(
                 Path(pickle_path) / f"{model_prefix}Hyperparameters.json", "w"
             ) as f:
-                f.write(json.dumps(model_json, indent=4))
+                json.dump(model_json, f, indent=4, default=repr)
 
         def tf_params():
             """
@@ -127,7 +334,7 @@ class ModelParameters:
             with open(
                 Path(pickle_path) / f"{model_prefix}Hyperparameters.json", "w"
             ) as f:
-                f.write(json.dumps(model_json, indent=4))
+                json.dump(model_json, f, indent=4)
 
         def xg_params():
             """
@@ -142,7 +349,7 @@ class ModelParameters:
             with open(
                 Path(pickle_path) / f"{model_prefix}Hyperparameters.json", "w"
             ) as f:
-                f.write(json.dumps(model_json, indent=4))
+                json.dump(model_json, f, indent=4)
 
         def h2o_params():
             """
@@ -153,7 +360,7 @@ class ModelParameters:
             with open(
                 Path(pickle_path) / f"{model_prefix}Hyperparameters.json", "w"
             ) as f:
-                f.write(json.dumps(model_json, indent=4))
+                json.dump(model_json, f, indent=4)
 
         def statsmodels_params():
             """
@@ -167,7 +374,7 @@ class ModelParameters:
             with open(
                 Path(pickle_path) / f"{model_prefix}Hyperparameters.json", "w"
             ) as f:
-                f.write(json.dumps(model_json, indent=4))
+                json.dump(model_json, f, indent=4)
 
         if model.__class__.__module__.__contains__("sklearn"):
             sklearn_params()
@@ -209,22 +416,60 @@ class ModelParameters:
         caslib : str, optional
             CAS Library on which the KPI data table is stored. The default value is
             "ModelPerformanceData".
+
+        Raises
+        ------
+        RuntimeError
+            If one or more models could not be updated, for example because a request
+            to SAS Model Manager failed. All other models are still updated before the
+            error is raised, and the first failure is chained as its cause.
         """
         kpis = cls.get_project_kpis(project, server, caslib)
-        models_to_update = kpis["ModelUUID"].unique().tolist()
+        if kpis.empty or "ModelUUID" not in kpis.columns:
+            return
+        # Map each model to its name for reporting models without a hyperparameter file
+        model_names = (
+            kpis.drop_duplicates("ModelUUID")
+            .set_index("ModelUUID")["ModelName"]
+            .to_dict()
+        )
 
-        for model in models_to_update:
-            try:
-                current_params, file_name = _find_file(model, "hyperparameters")
-            except:
-                print(
-                    f'No hyperparameter file for current model {kpis.loc[kpis["ModelUUID"]==model, "ModelName"].iloc[0]}. Attempting for next model...'
-                )
-            else:
-                updated_json = cls._update_json(model, current_params, kpis)
-                mr.add_model_content(
-                    model, json.dumps(updated_json, indent=4), file_name
-                )
+        failed_models = {}
+        with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+            # Group the KPI table once and submit each model's rows as they are
+            # produced instead of filtering the table for every model
+            futures = {
+                executor.submit(cls._process_model, model, rows): model
+                for model, rows in kpis.groupby("ModelUUID", sort=False, observed=True)
+            }
+            for future in as_completed(futures):
+                model = futures[future]
+                # Collect every failure so that one model cannot stop the others
+                # from being checked; failures are reported together below
+                try:
+                    updated = future.result()
+                except Exception as e:
+                    print(
+                        f"Failed to update KPIs for model "
+                        f"{model_names.get(model, model)} ({e!r}). Attempting for "
+                        f"next model..."
+                    )
+                    failed_models[model] = e
+                    continue
+                if not updated:
+                    print(
+                        f"No hyperparameter file for current model "
+                        f"{model_names.get(model, model)}. Attempting for next model..."
+                    )
+
+        if failed_models:
+            failures = ", ".join(
+                f"{model_names.get(model, model)} ({model}): {e!r}"
+                for model, e in failed_models.items()
+            )
+            raise RuntimeError(
+                f"KPIs could not be updated for the following models: {failures}."
+            ) from next(iter(failed_models.values()))
 
     @staticmethod
     def get_hyperparameters(model: Union[str, dict, RestObj]) -> Tuple[dict, str]:
@@ -232,6 +477,11 @@ class ModelParameters:
         Retrieves the hyperparameter json file from specified model on SAS Model
         Manager.
 
+        Retrieved files are cached for up to 60 seconds. Uploading a file through
+        add_hyperparameters or update_kpis invalidates the cached copy immediately,
+        but a file uploaded by other means, such as ModelRepository.add_model_content,
+        may not be returned until the cached copy expires.
+
         Parameters
         ----------
         model : str, dict, or RestObj
@@ -243,15 +493,47 @@ class ModelParameters:
             Dictionary containing the contents of the hyperparameter file and the file
             name.
         """
-        if mr.is_uuid(model):
-            id_ = model
-        elif isinstance(model, dict) and "id" in model:
-            id_ = model["id"]
+        id_ = _coerce_to_id(model)
+        return ModelParameters._get_hyperparameters_by_id(id_)
+
+    @staticmethod
+    def _get_hyperparameters_by_id(id_: str) -> Tuple[dict, str]:
+        """
+        Retrieves the hyperparameter json file from the model with the provided id
+        on SAS Model Manager.
+
+        Files are cached for a short time, so repeated calls for the same model skip
+        the request to SAS Model Manager. Expired entries are pruned whenever a new
+        file is cached. A copy of the cached contents is returned so that callers
+        cannot modify the cache.
+
+        Parameters
+        ----------
+        id_ : str
+            The id of the model.
+
+        Returns
+        -------
+        dict, str
+            Dictionary containing the contents of the hyperparameter file and the file
+            name.
+        """
+        now = time.monotonic()
+        cached = _HYPERPARAM_CACHE.get(id_)
+        if cached and now - cached[2] < _HYPERPARAM_CACHE_TTL:
+            file_contents, file_name, _ = cached
         else:
-            model = mr.get_model(model)
-            id_ = model["id"]
-        file_contents, file_name = _find_file(id_, "hyperparameters")
-        return file_contents, file_name
+            file_contents, file_name = _find_hyperparameter_file(id_)
+            # Prune expired entries so the cache does not grow with every model read;
+            # the items are copied first since update_kpis workers may pop entries
+            for key in [
+                k
+                for k, v in list(_HYPERPARAM_CACHE.items())
+                if now - v[2] >= _HYPERPARAM_CACHE_TTL
+            ]:
+                _HYPERPARAM_CACHE.pop(key, None)
+            _HYPERPARAM_CACHE[id_] = (file_contents, file_name, now)
+        return copy.deepcopy(file_contents), file_name
 
     @classmethod
     def add_hyperparameters(cls, model: Union[str, dict, RestObj], **kwargs) -> None:
@@ -268,21 +550,18 @@ class ModelParameters:
             hyperparameter file.
         """
 
-        if mr.is_uuid(model):
-            id_ = model
-        elif isinstance(model, dict) and "id" in model:
-            id_ = model["id"]
-        else:
-            model = mr.get_model(model)
-            id_ = model["id"]
-        hyperparameters, file_name = cls.get_hyperparameters(id_)
+        id_ = _coerce_to_id(model)
+        # Always read the current file before writing so that a cached copy cannot
+        # overwrite changes made since it was retrieved
+        hyperparameters, file_name = _find_hyperparameter_file(id_)
         for key, value in kwargs.items():
             hyperparameters["hyperparameters"][key] = value
         mr.add_model_content(
-            model,
-            json.dumps(hyperparameters, indent=4),
+            id_,
+            json.dumps(hyperparameters, separators=_COMPACT_SEPARATORS),
             file_name,
         )
+        _HYPERPARAM_CACHE.pop(id_, None)
 
     @staticmethod
     def get_project_kpis(
@@ -324,30 +603,17 @@ class ModelParameters:
             A pandas DataFrame representing the MM_STD_KPI table. Note that SAS
             missing values are replaced with pandas-valid missing values.
         """
-        # Check the pandas version for where the json_normalize function exists
-        if pd.__version__ >= StrictVersion("1.0.3"):
-            from pandas import json_normalize
-        else:
-            from pandas.io.json import json_normalize
-
         # Collect the current session for authentication of API calls
         sess = current_session()
 
-        # Step through options to determine project UUID
-        if is_uuid(project):
-            project_id = project
-        elif isinstance(project, dict) and "id" in project:
-            project_id = project["id"]
-        else:
-            project = mr.get_project(project)
-            project_id = project["id"]
+        project_id = _coerce_to_id(project, _resolve_project_id)
 
         # TODO: include case for large MM_STD_KPI tables
         # Call the casManagement service to collect the column names in the table
         kpi_table_columns = sess.get(
-            f"casManagement/servers/{server}/"
-            + f"caslibs/{caslib}/tables/"
-            + f"{project_id}.MM_STD_KPI/columns?limit=10000"
+            f"casManagement/servers/{server}/caslibs/{caslib}/tables/"
+            f"{project_id}.MM_STD_KPI/columns",
+            params={"limit": 10000},
         )
         if not kpi_table_columns:
             project = mr.get_project(project)
@@ -356,44 +622,47 @@ class ModelParameters:
                 + " Please confirm that the performance definition completed"
                 + " or custom KPIs have been uploaded successfully."
             )
-        # Parse through the json response to create a pandas DataFrame
-        cols = json_normalize(kpi_table_columns.json(), "items")
-        # Convert the columns to a readable list
-        col_names = cols["name"].to_list()
+        # Collect the column names from the json response
+        col_names = [col["name"] for col in kpi_table_columns.json()["items"]]
 
-        # Filter rows returned by column and value provided in arguments
-        where_statement = ""
+        # Filter rows returned by column and value provided in arguments; the value is
+        # quoted as a SAS string literal and the query string is encoded by requests
+        params = {"limit": 10000}
         if filter_column and filter_value:
-            where_statement = f"&where={filter_column}='{filter_value}'"
+            quoted_value = str(filter_value).replace("'", "''")
+            params["where"] = f"{filter_column}='{quoted_value}'"
 
         # Call the casRowSets service to return row values
         # Optional where statement is included
         kpi_table_rows = sess.get(
-            f"casRowSets/servers/{server}/"
-            + f"caslibs/{caslib}/tables/"
-            + f"{project_id}.MM_STD_KPI/rows?limit=10000"
-            + f"{where_statement}"
+            f"casRowSets/servers/{server}/caslibs/{caslib}/tables/"
+            f"{project_id}.MM_STD_KPI/rows",
+            params=params,
         )
-        # If no "cells" are found in the json response, return an error
         try:
-            kpi_table_df = pd.DataFrame(
-                json_normalize(kpi_table_rows.json()["items"])["cells"].to_list(),
-                columns=col_names,
-            )
+            cells = [row["cells"] for row in kpi_table_rows.json()["items"]]
         except KeyError:
+            cells = []
+        # If no "cells" are found in the json response, return an error
+        if not cells:
             if filter_column and filter_value:
                 raise SystemError(
-                    "No KPIs were found when filtering with {filter_column}='{"
-                    "filter_value}'."
+                    f"No KPIs were found when filtering with {filter_column}='"
+                    f"{filter_value}'."
                 )
             else:
                 project_name = mr.get_project(project)["name"]
                 raise SystemError(f"No KPIs were found for project {project_name}.")
-
-        # Strip leading spaces from cells of KPI table; convert missing values to None
-        kpi_table_df = kpi_table_df.apply(lambda x: x.str.strip()).replace(
-            {".": None, "": None}
-        )
+        kpi_table_df = pd.DataFrame(cells, columns=col_names)
+
+        # Strip leading spaces from string cells of KPI table; non-string cells are
+        # left untouched so their values are not replaced with NaN
+        obj_cols = kpi_table_df.select_dtypes(include="object").columns
+        for col in obj_cols:
+            stripped = kpi_table_df[col].str.strip()
+            kpi_table_df[col] = stripped.where(stripped.notna(), kpi_table_df[col])
+        # Convert SAS missing values to None
+        kpi_table_df[obj_cols] = kpi_table_df[obj_cols].replace({".": None, "": None})
 
         return kpi_table_df
 
@@ -638,3 +638,31 @@ def test_load_expired_token_no_refresh(read_cache, oauth, prompt):
 
     # prompt_for_auth_code() should have been called once
     assert prompt.call_count == 1
+
+
+def test_expired_token_refreshed_once():
+    """Expired tokens already refreshed by another thread should not be refreshed again."""
+    s = Session("hostname", token=ACCESS_TOKEN)
+    refreshed_token = OAuth2Token("def456", REFRESH_TOKEN)
+
+    expired = mock.MagicMock(status_code=401)
+    expired.headers = {"WWW-Authenticate": 'Bearer error="access token expired"'}
+    success = mock.MagicMock(status_code=200)
+
+    def request(*args, **kwargs):
+        if request.calls == 0:
+            # Simulate another thread refreshing the token while this request is sent
+            s.auth = refreshed_token
+        request.calls += 1
+        return expired if request.calls == 1 else success
+
+    request.calls = 0
+
+    with mock.patch("sasctl.core.requests.Session.request", side_effect=request):
+        with mock.patch.object(s, "_request_token_with_oauth") as refresh:
+            r = s.request("GET", "/test")
+
+    assert r is success
+    assert request.calls == 2
+    refresh.assert_not_called()
+    assert s.auth is refreshed_token
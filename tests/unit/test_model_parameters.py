@@ -2,6 +2,7 @@ import ast
 import copy
 import json
 import tempfile
+import time
 import warnings
 from pathlib import Path
 from unittest import mock
@@ -88,6 +89,29 @@ class TestSKLearnModel:
             Path(tmp_dir.name) / f"./{self.MODEL_NAME}Hyperparameters.json"
         ).exists()
 
+    def test_generate_pipeline_hyperparameters(self, sklearn_model):
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        pipeline = Pipeline([("scaler", StandardScaler()), ("model", sklearn_model)])
+        tmp_dir = tempfile.TemporaryDirectory()
+        file_path = Path(tmp_dir.name) / f"{self.MODEL_NAME}Hyperparameters.json"
+
+        # ensure that nested estimators are only included when requested
+        mp.generate_hyperparameters(pipeline, self.MODEL_NAME, Path(tmp_dir.name))
+        with open(file_path) as f:
+            hyperparameters = json.load(f)["hyperparameters"]
+        assert "steps" in hyperparameters
+        assert "model__max_iter" not in hyperparameters
+
+        mp.generate_hyperparameters(
+            pipeline, self.MODEL_NAME, Path(tmp_dir.name), deep=True
+        )
+        with open(file_path) as f:
+            hyperparameters = json.load(f)["hyperparameters"]
+        assert hyperparameters["model__max_iter"] == 1000
+        assert isinstance(hyperparameters["model"], str)
+
     def test_bad_model_hyperparameters(self, bad_model):
         tmp_dir = tempfile.TemporaryDirectory()
         with pytest.raises(ValueError):
@@ -96,18 +120,15 @@ class TestSKLearnModel:
     def test_update_json(self):
         from sasctl.pzmm.model_parameters import ModelParameters as mp
 
-        # ensure that only relevant rows are added to hyperparameter json
-
+        # ensure that a model without KPIs returns the same file
         input_json = copy.deepcopy(self.TESTJSON)
-        input_kpis = copy.deepcopy(self.KPIS)
-        assert (
-            mp._update_json(self.MODELS[1]["id"], input_json, input_kpis)
-            == self.TESTJSON
-        )
+        model_rows = self.KPIS.loc[self.KPIS["ModelUUID"] == self.MODELS[1]["id"]]
+        assert mp._update_json(input_json, model_rows) == self.TESTJSON
 
         input_json = copy.deepcopy(self.TESTJSON)
         input_kpis = copy.deepcopy(self.KPIS)
-        updated_json = mp._update_json(self.MODELS[0]["id"], input_json, input_kpis)
+        model_rows = input_kpis.loc[input_kpis["ModelUUID"] == self.MODELS[0]["id"]]
+        updated_json = mp._update_json(input_json, model_rows)
 
         pd.testing.assert_frame_equal(input_kpis, self.KPIS)
         assert "hyperparameters" in updated_json
@@ -116,13 +137,34 @@ class TestSKLearnModel:
         assert len(updated_json["kpis"]) == 1
         assert updated_json["kpis"] == {"0": {"TestKPI": 1}}
         assert "TimeLabel" not in updated_json["kpis"]
+        assert "ModelUUID" not in updated_json["kpis"]["0"]
+
+        # ensure that missing values are converted to None, matching the json output
+        model_rows = pd.DataFrame(
+            {
+                "ModelUUID": ["12345", "12345"],
+                "TestKPI": [1.5, np.nan],
+                "TestName": ["a", None],
+                "TimeLabel": ["Q1", "Q2"],
+            }
+        )
+        updated_json = mp._update_json(copy.deepcopy(self.TESTJSON), model_rows)
+        assert updated_json["kpis"] == json.loads(
+            model_rows.drop(columns=["ModelUUID"])
+            .set_index("TimeLabel")
+            .to_json(orient="index")
+        )
+        assert updated_json["kpis"]["Q2"] == {"TestKPI": None, "TestName": None}
 
-    def test_find_file(self):
+    def test_search_model_contents(self):
         FILE_RESPONSE = Response()
         FILE_RESPONSE.status_code = 200
         FILE_RESPONSE.body = json.dumps(self.TESTJSON).encode("utf-8")
 
-        from sasctl.pzmm.model_parameters import _find_file
+        from sasctl.pzmm.model_parameters import (
+            _find_hyperparameter_file,
+            _search_model_contents,
+        )
 
         with mock.patch("sasctl.core.Session._get_authorization_token"):
             current_session("example.com", self.USER, "password")
@@ -130,9 +172,267 @@ class TestSKLearnModel:
         with mock.patch(
             "sasctl._services.model_repository.ModelRepository.get_model_contents"
         ) as get_model_contents:
-            get_model_contents.return_value = copy.deepcopy(self.MODEL_FILES)
-            with pytest.raises(ValueError):
-                _find_file(self.MODEL_NAME, "file0")
+            with mock.patch(
+                "sasctl._services.model_repository.ModelRepository.get"
+            ) as get:
+                get_model_contents.return_value = copy.deepcopy(self.MODEL_FILES)
+                get.return_value = []
+                with pytest.raises(ValueError):
+                    _search_model_contents(
+                        self.MODEL_NAME,
+                        "file0",
+                        {"filter": 'contains($primary,name,"file0")'},
+                    )
+
+                # ensure that a server side match skips the full listing
+                get_model_contents.reset_mock()
+                get.reset_mock()
+                get.side_effect = [
+                    RestObj({"name": "File2", "id": "2"}),
+                    copy.deepcopy(self.TESTJSON),
+                ]
+                assert _search_model_contents(
+                    self.MODEL_NAME,
+                    "file2",
+                    {"filter": 'contains($primary,name,"file2")'},
+                ) == (self.TESTJSON, "File2")
+                get_model_contents.assert_not_called()
+                assert get.call_args_list[0][1]["params"] == {
+                    "filter": 'contains($primary,name,"file2")'
+                }
+                get.assert_called_with(f"models/{self.MODEL_NAME}/contents/2/content")
+
+                # ensure that the full listing is used when the filter has no match
+                get.reset_mock()
+                get.side_effect = [[], copy.deepcopy(self.TESTJSON)]
+                get_model_contents.return_value = [
+                    RestObj({"name": "file1", "id": "1"}),
+                    RestObj({"name": "FILE2", "id": "2"}),
+                ]
+                assert _search_model_contents(
+                    self.MODEL_NAME,
+                    "file2",
+                    {"filter": 'contains($primary,name,"file2")'},
+                ) == (self.TESTJSON, "FILE2")
+                get_model_contents.assert_called_once_with(self.MODEL_NAME)
+
+                # ensure that the hyperparameter search uses the same filter
+                get.reset_mock()
+                get.side_effect = [
+                    RestObj({"name": "ModelHyperparameters.json", "id": "3"}),
+                    copy.deepcopy(self.TESTJSON),
+                ]
+                assert _find_hyperparameter_file("12345") == (
+                    self.TESTJSON,
+                    "ModelHyperparameters.json",
+                )
+                assert get.call_args_list[0][1]["params"] == {
+                    "filter": 'contains($primary,name,"hyperparameters")'
+                }
+
+    def test_retry(self):
+        from sasctl.core import HTTPError
+        from sasctl.pzmm.model_parameters import _retry
+
+        func = mock.Mock(side_effect=[HTTPError("url", 503, "", {}, None), "done"])
+        with mock.patch("sasctl.pzmm.model_parameters.time.sleep") as sleep:
+            # ensure that server errors are retried
+            assert _retry(func)() == "done"
+            assert func.call_count == 2
+            sleep.assert_called_once()
+
+            # ensure that client errors are raised immediately
+            func = mock.Mock(side_effect=HTTPError("url", 404, "", {}, None))
+            with pytest.raises(HTTPError):
+                _retry(func)()
+            assert func.call_count == 1
+
+    def test_update_kpis(self, capsys):
+        kpis = pd.DataFrame(
+            {
+                "ModelUUID": ["12345", "67890", "12345"],
+                "ModelName": ["TestModel1", "TestModel2", "TestModel1"],
+                "TestKPI": [1, 5, 9],
+                "TimeLabel": [0, 0, 1],
+            }
+        )
+
+        def find_file(model):
+            if model == "67890":
+                raise ValueError
+            return copy.deepcopy(self.TESTJSON), "TestModel1Hyperparameters.json"
+
+        with mock.patch(
+            "sasctl.pzmm.model_parameters.ModelParameters.get_project_kpis"
+        ) as get_project_kpis:
+            with mock.patch(
+                "sasctl.pzmm.model_parameters._find_hyperparameter_file",
+                side_effect=find_file,
+            ):
+                with mock.patch(
+                    "sasctl._services.model_repository.ModelRepository"
+                    ".add_model_content"
+                ) as add_model_content:
+                    get_project_kpis.return_value = kpis
+                    mp.update_kpis(self.PROJECT)
+
+                    # ensure that models without a hyperparameter file are skipped
+                    add_model_content.assert_called_once()
+                    assert "TestModel2" in capsys.readouterr().out
+
+                    # ensure that an empty KPI table makes no requests
+                    add_model_content.reset_mock()
+                    get_project_kpis.return_value = kpis.iloc[0:0]
+                    mp.update_kpis(self.PROJECT)
+                    add_model_content.assert_not_called()
+
+                    # ensure that unused categories of ModelUUID are not processed
+                    kpis["ModelUUID"] = pd.Categorical(
+                        kpis["ModelUUID"], categories=["12345", "67890", "00000"]
+                    )
+                    get_project_kpis.return_value = kpis.iloc[[0, 2]]
+                    mp.update_kpis(self.PROJECT)
+                    add_model_content.assert_called_once()
+                    model, file, file_name = add_model_content.call_args[0]
+                    assert model == "12345"
+                    assert file_name == "TestModel1Hyperparameters.json"
+                    assert json.loads(file)["kpis"] == {
+                        "0": {"ModelName": "TestModel1", "TestKPI": 1},
+                        "1": {"ModelName": "TestModel1", "TestKPI": 9},
+                    }
+
+                    # ensure that errors updating a file are not reported as a
+                    # missing hyperparameter file
+                    add_model_content.reset_mock()
+                    capsys.readouterr()
+                    get_project_kpis.return_value = kpis.iloc[[0, 0]]
+                    with pytest.raises(RuntimeError, match="TestModel1") as e:
+                        mp.update_kpis(self.PROJECT)
+                    assert isinstance(e.value.__cause__, ValueError)
+                    add_model_content.assert_not_called()
+                    assert "No hyperparameter file" not in capsys.readouterr().out
+
+    def test_update_kpis_http_error(self, capsys):
+        from sasctl.core import HTTPError
+
+        kpis = pd.DataFrame(
+            {
+                "ModelUUID": ["12345", "67890", "13579"],
+                "ModelName": ["TestModel1", "TestModel2", "TestModel2"],
+                "TestKPI": [1, 5, 7],
+                "TimeLabel": [0, 0, 0],
+            }
+        )
+
+        def find_file(model):
+            if model == "67890":
+                raise HTTPError("url", 403, "", {}, None)
+            if model == "13579":
+                raise ConnectionError("Connection refused")
+            return copy.deepcopy(self.TESTJSON), "TestModel1Hyperparameters.json"
+
+        with mock.patch(
+            "sasctl.pzmm.model_parameters.ModelParameters.get_project_kpis"
+        ) as get_project_kpis:
+            with mock.patch(
+                "sasctl.pzmm.model_parameters._find_hyperparameter_file",
+                side_effect=find_file,
+            ):
+                with mock.patch(
+                    "sasctl._services.model_repository.ModelRepository"
+                    ".add_model_content"
+                ) as add_model_content:
+                    get_project_kpis.return_value = kpis
+
+                    # ensure that remaining models are updated before the failure is
+                    # reported
+                    with pytest.raises(RuntimeError, match="TestModel2") as e:
+                        mp.update_kpis(self.PROJECT)
+                    assert isinstance(e.value.__cause__, (HTTPError, ConnectionError))
+                    add_model_content.assert_called_once()
+
+                    # ensure that every failure is reported, including models sharing
+                    # a name and errors other than HTTPError
+                    assert "67890" in str(e.value)
+                    assert "13579" in str(e.value)
+                    assert "ConnectionError" in str(e.value)
+                    assert add_model_content.call_args[0][0] == "12345"
+                    assert "TestModel2" in capsys.readouterr().out
+
+    def test_coerce_to_id(self):
+        from sasctl.pzmm.model_parameters import _coerce_to_id, _resolve_project_id
+
+        model_id = uuid.uuid4()
+        with mock.patch(
+            "sasctl._services.model_repository.ModelRepository.get_model"
+        ) as get_model:
+            with mock.patch(
+                "sasctl._services.model_repository.ModelRepository.get_project"
+            ) as get_project:
+                get_model.return_value = {"id": "modelID"}
+                get_project.return_value = self.PROJECT
+
+                # ensure that ids are returned without a lookup
+                assert _coerce_to_id(str(model_id)) == str(model_id)
+                assert _coerce_to_id(model_id) == str(model_id)
+                assert _coerce_to_id(self.MODELS[0]) == self.MODELS[0]["id"]
+                get_model.assert_not_called()
+
+                # ensure that names are looked up with the provided resolver
+                assert _coerce_to_id({"name": "CoerceModel"}) == "modelID"
+                get_model.assert_called_once_with("CoerceModel")
+                assert (
+                    _coerce_to_id("Project", _resolve_project_id) == self.PROJECT["id"]
+                )
+                get_project.assert_called_once_with("Project")
+
+                with pytest.raises(TypeError):
+                    _coerce_to_id(12345)
+
+    def test_get_hyperparameters_cache(self):
+        from sasctl.pzmm.model_parameters import (
+            _HYPERPARAM_CACHE,
+            _HYPERPARAM_CACHE_TTL,
+        )
+
+        _HYPERPARAM_CACHE.clear()
+        with mock.patch(
+            "sasctl.pzmm.model_parameters._find_hyperparameter_file"
+        ) as find_file:
+            with mock.patch(
+                "sasctl._services.model_repository.ModelRepository.add_model_content"
+            ):
+                find_file.return_value = (
+                    copy.deepcopy(self.TESTJSON),
+                    "TestModel1Hyperparameters.json",
+                )
+                model_id = str(uuid.uuid4())
+
+                # ensure that repeated calls reuse the retrieved file
+                hyperparameters, _ = mp.get_hyperparameters(model_id)
+                hyperparameters["hyperparameters"]["TEST"] = "2"
+                hyperparameters, _ = mp.get_hyperparameters(model_id)
+                find_file.assert_called_once()
+
+                # ensure that callers cannot modify the cached file
+                assert hyperparameters == self.TESTJSON
+
+                # ensure that uploading always reads the current file and invalidates
+                # the cache
+                mp.add_hyperparameters(model_id, TEST="2")
+                assert find_file.call_count == 2
+                mp.get_hyperparameters(model_id)
+                assert find_file.call_count == 3
+
+                # ensure that expired entries are pruned when a new file is cached
+                _HYPERPARAM_CACHE["expired"] = (
+                    {},
+                    "ExpiredHyperparameters.json",
+                    time.monotonic() - _HYPERPARAM_CACHE_TTL,
+                )
+                mp.get_hyperparameters(str(uuid.uuid4()))
+                assert "expired" not in _HYPERPARAM_CACHE
+                assert model_id in _HYPERPARAM_CACHE
 
     def test_add_hyperparamters(self):
         with mock.patch("sasctl.core.Session._get_authorization_token"):
@@ -142,7 +442,7 @@ class TestSKLearnModel:
             "sasctl._services.model_repository.ModelRepository" ".add_model_content"
         ) as add_model_content:
             with mock.patch(
-                "sasctl.pzmm.model_parameters.ModelParameters.get_hyperparameters"
+                "sasctl.pzmm.model_parameters._find_hyperparameter_file"
             ) as get_hyperparameters:
                 with mock.patch(
                     "sasctl._services.model_repository.ModelRepository.get_model"
@@ -157,6 +457,9 @@ class TestSKLearnModel:
                     # ensure that argument with no kwargs returns same file
                     mp.add_hyperparameters("TestModel1")
                     test = add_model_content.call_args_list[0]
+                    assert test[0][0] == self.MODELS[0]["id"]
+                    get_hyperparameters.assert_called_with(self.MODELS[0]["id"])
+                    get_model.assert_called_once_with("TestModel1")
                     assert (
                         json.loads(add_model_content.call_args_list[0][0][1])
                         == self.TESTJSON
@@ -181,6 +484,9 @@ class TestSKLearnModel:
                         == "2"
                     )
 
+                    # ensure that the model name is resolved again on each call
+                    assert get_model.call_count == 3
+
     def test_get_project_kpis(self):
         cols = Response()
         cols.status_code = 200
@@ -188,7 +494,9 @@ class TestSKLearnModel:
 
         rows = Response()
         rows.status_code = 200
-        rows._content = json.dumps({"items": {"cells": ["testValue"]}}).encode("utf-8")
+        rows._content = json.dumps({"items": [{"cells": ["testValue"]}]}).encode(
+            "utf-8"
+        )
         with mock.patch("sasctl.core.Session._get_authorization_token"):
             current_session("example.com", self.USER, "password")
 
@@ -218,6 +526,58 @@ class TestSKLearnModel:
 
                 assert not kpi_table.loc[1]["testName"]
 
+                # ensure that non-string columns are not replaced by NaN
+                get.reset_mock(side_effect=True)
+                cols._content = json.dumps(
+                    {"items": [{"name": "testName"}, {"name": "testNumber"}]}
+                ).encode("utf-8")
+                rows._content = json.dumps(
+                    {"items": [{"cells": [" testValue", 1]}, {"cells": [".", 2]}]}
+                ).encode("utf-8")
+                get.side_effect = [cols, rows]
+
+                kpi_table = mp.get_project_kpis("Project")
+
+                assert kpi_table["testName"].to_list() == ["testValue", None]
+                assert kpi_table["testNumber"].to_list() == [1, 2]
+
+                # ensure that numbers in mixed columns are not replaced by NaN
+                get.reset_mock(side_effect=True)
+                rows._content = json.dumps(
+                    {
+                        "items": [
+                            {"cells": [" testValue", 1.5]},
+                            {"cells": [".", "."]},
+                            {"cells": ["testValue2", None]},
+                        ]
+                    }
+                ).encode("utf-8")
+                get.side_effect = [cols, rows]
+
+                kpi_table = mp.get_project_kpis("Project")
+
+                assert kpi_table["testName"].to_list() == [
+                    "testValue",
+                    None,
+                    "testValue2",
+                ]
+                assert kpi_table["testNumber"].to_list() == [1.5, None, None]
+
+                # ensure that filter values are passed as encoded query parameters
+                get.reset_mock(side_effect=True)
+                get.side_effect = [cols, rows]
+                mp.get_project_kpis(
+                    "Project", filter_column="ModelName", filter_value="Model's & 1"
+                )
+                assert get.call_args_list[0][1]["params"] == {"limit": 10000}
+                assert get.call_args_list[1][0][0].endswith(
+                    f"{self.PROJECT['id']}.MM_STD_KPI/rows"
+                )
+                assert get.call_args_list[1][1]["params"] == {
+                    "limit": 10000,
+                    "where": "ModelName='Model''s & 1'",
+                }
+
 
 class TestSyncModelProperties(unittest.TestCase):
     MODEL_PROPERTIES = [